@@ -1,2 +1,2 @@
-from .autoplugin import register, launch, generate
+from .autoplugin import register, launch, generate, finalize
 from .basic_app import get_app
\ No newline at end of file
@@ -5,26 +5,101 @@ All rights reserved.
 This source code is licensed under the BSD-style license found in the
 LICENSE file in the root directory of this source tree. 
 """
+import ast
 import functools
+import hashlib
 import os
-from os.path import join
+from os.path import dirname, expanduser, join
 import inspect
-from typing import Callable, List, Dict, Any, Optional
+import linecache
+import tempfile
+from typing import Callable, List, Dict, Any, Optional, Tuple, Type
 from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import PlainTextResponse
-import uvicorn
+from fastapi.responses import PlainTextResponse, Response
+from fastapi.routing import APIRoute
 from pydantic import BaseModel, create_model
-from fastapi.openapi.utils import get_openapi
-import yaml
-import json
+import orjson
+from .responses import dumps
 
 
-_func_description_chain = None
+_EMPTY = inspect.Parameter.empty  # same sentinel as inspect.Signature.empty
+# (app, func, routes) for registered functions whose description is generated lazily by `finalize`
+_pending_descriptions: List[Tuple[FastAPI, Callable, List[APIRoute]]] = []
+# generated descriptions, one file per function source hash
+_description_cache_dir = join(os.environ.get("XDG_CACHE_HOME", join(expanduser("~"), ".cache")), "autoplugin", "desc")
+# request models keyed by model name and (name, annotation, default) of each field
+_model_cache: Dict[Tuple, Type[BaseModel]] = {}
+# every endpoint responds with {"result": ...}, so they all document the same response model
+_ResponseModel = create_model("ResponseModel", result=(Any, ...))
+# plugin manifest template. `generate` copies it and fills in the version and user overrides
+_DEFAULT_PLUGIN_SPEC = {
+    "name_for_human": "Custom Plugin",
+    "name_for_model": "Custom Plugin",
+    "description_for_human": "Unspecified custom plugin. Add behavior here.",
+    "description_for_model": "Unspecified custom plugin. Add behavior here.",
+    "schema_version": "v1",
+    "auth": {
+        "type": "none"
+    },
+    "api": {
+        "type": "openapi",
+        "url": "http://localhost:8000/openapi.yaml",
+        "is_user_authenticated": False
+    },
+    "logo_url": "http://example.com/logo.png",
+    "contact_email": "support@example.com",
+    "legal_info_url": "http://www.example.com/legal"
+}
+# OpenAI settings for generated endpoint descriptions. max_tokens fits the 50-word cap in the prompt
+_DESCRIPTION_LLM_KWARGS = {"temperature": 0, "max_tokens": 80}
+# few-shot prompt for generated endpoint descriptions, filled in with the function source
+_DESCRIPTION_PROMPT_TEMPLATE = """
+            Come up with a concise description for this function for the OpenAPI spec that would serve as a useful description for a ChatGPT plugin to know when to call it.
+            It should be at most one or two sentences, and must be less than 50 words.
+            Function:
+            ```python
+            async def add(a: int, b: int) -> int:
+                return a + b
+            ```
+            Description:
+            Adds two numbers
+            Function:
+            ```python
+            async def hello(name: str) -> str:
+                return "Hello, " + name + "!".
+            ```
+            Description:
+            Greets person with specified name.
+            Function:
+            ```python
+            async def pow(base: int, power: int = 2) -> int:
+                return base ** pow
+            ```
+            Description:
+            Raises a number to a power.
+            Function:
+            ```python
+            {func_str}
+            ```
+            Description:
+            """
+# (key, character limit) pairs checked in the plugin spec
+_PLUGIN_SPEC_LIMITS = (
+    ("name_for_human", 50),
+    ("name_for_model", 50),
+    ("description_for_human", 120),
+    ("description_for_model", 8000),  # will decrease over time
+)
 
 
-def launch(app: FastAPI, host="127.0.0.1", port=8000):
-    uvicorn.run(app, host=host, port=port)
+def launch(app: FastAPI, host="127.0.0.1", port=8000, timeout_keep_alive=75, **kwargs):
+    """ kwargs are passed on to `uvicorn.run`. uvicorn picks uvloop and httptools automatically when installed
+    (`pip install 'autoplugin[fast]'`) """
+    import uvicorn
+
+    finalize(app)
+    uvicorn.run(app, host=host, port=port, timeout_keep_alive=timeout_keep_alive, **kwargs)
 
 
 def generate(app: FastAPI, version="v1", out_dir=".well-known",
@@ -32,27 +107,13 @@ def generate(app: FastAPI, version="v1", out_dir=".well-known",
              name="", description="",
              **kwargs):
     """ kwargs should be key-value pairs for the plugin_spec json """
+    import yaml
+
+    finalize(app)
     os.makedirs(out_dir, exist_ok=True)
 
     """ Plugin manifest file """
-    plugin_spec = {
-        "name_for_human": "Custom Plugin",
-        "name_for_model": "Custom Plugin",
-        "description_for_human": "Unspecified custom plugin. Add behavior here.",
-        "description_for_model": "Unspecified custom plugin. Add behavior here.",
-        "schema_version": version,
-        "auth": {
-            "type": "none"
-        },
-        "api": {
-            "type": "openapi",
-            "url": "http://localhost:8000/openapi.yaml",
-            "is_user_authenticated": False
-        },
-        "logo_url": "http://example.com/logo.png",
-        "contact_email": "support@example.com",
-        "legal_info_url": "http://www.example.com/legal"
-    }
+    plugin_spec = {**_DEFAULT_PLUGIN_SPEC, "schema_version": version}
     
     if name:
         plugin_spec["name_for_human"] = name
@@ -63,39 +124,41 @@ def generate(app: FastAPI, version="v1", out_dir=".well-known",
     plugin_spec.update(kwargs)
 
     # character limit checks
-    _plugin_check_limit(plugin_spec, "name_for_human", 50)
-    _plugin_check_limit(plugin_spec, "name_for_model", 50)
-    _plugin_check_limit(plugin_spec, "description_for_human", 120)
-    _plugin_check_limit(plugin_spec, "description_for_model",
-                       8000)  # will decrease over time
+    for key, char_limit in _PLUGIN_SPEC_LIMITS:
+        _plugin_check_limit(plugin_spec, key, char_limit)
 
     if overwrite_plugin_spec or not os.path.exists(join(out_dir, "ai-plugin.json")):
-        with open(join(out_dir, "ai-plugin.json"), "w") as plugin_json:
-            json.dump(plugin_spec, plugin_json, indent=4)
+        with open(join(out_dir, "ai-plugin.json"), "wb") as plugin_json:
+            plugin_json.write(orjson.dumps(plugin_spec, option=orjson.OPT_INDENT_2))
 
     @app.get("/.well-known/ai-plugin.json", response_class=PlainTextResponse)
     async def get_plugin_json():
-        with open(join(out_dir, "ai-plugin.json"), "r") as f:
+        with open(join(out_dir, "ai-plugin.json"), "r", encoding="utf-8") as f:  # orjson writes UTF-8
             content = f.read()
         return content
     
     """ OpenAPI spec """
-    openapi = get_openapi(
-        title=plugin_spec["name_for_human"],
-        version=version,
-        routes=app.routes,
-    )
-
     if overwrite_openapi_spec or not os.path.exists(join(out_dir, "openapi.yaml")):
-        with open(join(out_dir, "openapi.yaml"), "w") as openapi_yaml:
-            yaml.dump(openapi, openapi_yaml, sort_keys=False)
+        from fastapi.openapi.utils import get_openapi
+
+        openapi = get_openapi(
+            title=plugin_spec["name_for_human"],
+            version=version,
+            routes=app.routes,
+        )
+        with open(join(out_dir, "openapi.yaml"), "w", encoding="utf-8") as openapi_yaml:
+            # libyaml-backed dumper when available, the pure-Python one is much slower on large specs
+            yaml.dump(openapi, openapi_yaml, Dumper=getattr(yaml, "CSafeDumper", yaml.SafeDumper), sort_keys=False)
     
     @app.get("/openapi.yaml", response_class=PlainTextResponse)
     async def get_openapi_yaml():
-        with open(join(out_dir, "openapi.yaml"), "r") as f:
+        with open(join(out_dir, "openapi.yaml"), "r", encoding="utf-8") as f:
             content = f.read()
         return content
 
+    # drop any /openapi.json schema built earlier, so it is rebuilt with the routes added above
+    app.openapi_schema = None
+
 
 def register(app: FastAPI,
              func: Callable = None,
@@ -107,69 +170,98 @@ def register(app: FastAPI,
     if func is None:
         return functools.partial(register, app, methods=methods, description=description, generate_description=generate_description)
 
+    # generated descriptions are deferred to `finalize` so all functions share one LLM request
+    pending_description = False
     if description is None:
         if generate_description is None:
             # user did not specify whether to generate. generate if no docstring, otherwise use docstring
-            description = _generate_description(func) if func.__doc__ is None else func.__doc__
+            pending_description = func.__doc__ is None
+            description = func.__doc__
         elif generate_description:
-            description = _generate_description(func)
+            pending_description = True
         else:  # generate_description is False. use docstring if it exists, otherwise use None (no description)
             description = func.__doc__
     if methods is None:
         methods = ["POST"]
-
-    @functools.wraps(func)
-    async def wrapper(*args, **kwargs):
-        return await func(*args, **kwargs)
-
-    def get_post_wrapper(func):
-        signature = inspect.signature(func)
+    # one model for both the POST body and the GET query parameters, kept on the function for re-registration
+    Model = getattr(func, "_autoplugin_model", None)
+    if Model is None:
         fields = {
-            param.name: (
-                param.annotation,
-                param.default if param.default != inspect.Parameter.empty else ...,
+            param_name: (
+                param.annotation if param.annotation is not _EMPTY else str,
+                param.default if param.default is not _EMPTY else ...,
             )
-            for param in signature.parameters.values()
+            for param_name, param in inspect.signature(func).parameters.items()
         }
-        Model = create_model(func.__name__ + "Model", **fields)
-
-        async def post_wrapper(payload: Model):
-            result = await wrapper(**payload.dict())
-            return {"result": result}
-
-        return post_wrapper
-    
-    ResponseModel = create_model(f"{func.__name__}ResponseModel", result=(Any, ...))
+        Model = _get_model(func.__name__ + "Model", fields)
+        try:
+            func._autoplugin_model = Model
+        except AttributeError:  # e.g. bound methods don't accept new attributes
+            pass
 
+    routes = []
     for method in methods:
         if method == "GET":
-            # Create a Pydantic model for the GET request query parameters
-            GetModel = create_model(
-                func.__name__ + "GetModel",
-                **{
-                    param_name: (
-                        getattr(inspect.signature(func).parameters[param_name], "annotation", str),
-                        (
-                            getattr(inspect.signature(func).parameters[param_name], "default", None)
-                            if getattr(inspect.signature(func).parameters[param_name], "default", None) != inspect.Parameter.empty
-                            else ...
-                        ),
-                    )
-                    for param_name in inspect.signature(func).parameters
-                },
-            )
-
-            async def get_wrapper(params: GetModel = Depends()):
-                result = await wrapper(**params.dict())
-                return {"result": result}
-
-            app.get(f"/{func.__name__}", description=description, response_model=ResponseModel)(get_wrapper)
+            get_wrapper = _compile_endpoint("get_wrapper", "params", "params: Model = Depends()", func, Model)
+            app.get(f"/{func.__name__}", description=description, response_model=_ResponseModel)(get_wrapper)
+            routes.append(app.router.routes[-1])
         elif method == "POST":
-            post_wrapper = get_post_wrapper(func)
+            post_wrapper = _compile_endpoint("post_wrapper", "payload", "payload: Model", func, Model)
             app.post(f"/{func.__name__}",
-                     description=description, response_model=ResponseModel)(post_wrapper)
+                     description=description, response_model=_ResponseModel)(post_wrapper)
+            routes.append(app.router.routes[-1])
+
+    if pending_description:
+        if not any(pending_app is app for pending_app, _, _ in _pending_descriptions):
+            # covers apps served without `generate` or `launch`, e.g. `uvicorn module:app`
+            app.add_event_handler("startup", functools.partial(finalize, app))
+        _pending_descriptions.append((app, func, routes))
+
+    return func
 
-    return wrapper
+
+def finalize(app: FastAPI):
+    """ Generates the descriptions still pending for functions registered on `app`, in a single batched LLM request.
+    Called automatically by `generate`, `launch`, and on app startup. """
+    global _pending_descriptions
+    pending = [entry for entry in _pending_descriptions if entry[0] is app]
+    if not pending:
+        return
+    descriptions = _generate_descriptions([func for _, func, _ in pending])
+    # only dequeue once generation succeeded, so a failed LLM call can be retried by calling `finalize` again
+    done = {id(entry) for entry in pending}
+    _pending_descriptions = [entry for entry in _pending_descriptions if id(entry) not in done]
+    for (_, _, routes), description in zip(pending, descriptions):
+        for route in routes:
+            route.description = description
+    app.openapi_schema = None  # drop any schema built with the missing descriptions
+
+
+def _compile_endpoint(endpoint_name: str, arg_name: str, arg_source: str,
+                      func: Callable, Model: Type[BaseModel]) -> Callable:
+    """ Generates `async def <endpoint_name>(<arg_source>)`, which passes each field of the validated model to `func`
+    as `field=<arg_name>.field`, so requests don't build and unpack a kwargs dict.
+    The fixed `{"result": ...}` body is assembled from bytes, so only the result itself is serialized """
+    call_args = ", ".join(f"{name}={arg_name}.{name}" for name in Model.__fields__)
+    source = (f"async def {endpoint_name}({arg_source}):\n"
+              f"    result = dumps(await func({call_args}))\n"
+              f"    return Response(b'{{\"result\":' + result + b'}}', media_type=\"application/json\")\n")
+    namespace = {"__name__": __name__, "func": func, "Model": Model, "Depends": Depends,
+                 "Response": Response, "dumps": dumps}
+    exec(source, namespace)
+    return namespace[endpoint_name]
+
+
+def _get_model(model_name: str, fields: Dict[str, Tuple[Any, Any]]) -> Type[BaseModel]:
+    try:
+        key = (model_name, tuple((name, annotation, type(default), default)
+                                 for name, (annotation, default) in fields.items()))
+        Model = _model_cache.get(key)
+    except TypeError:  # unhashable default (e.g. a list), build without caching
+        return create_model(model_name, **fields)
+    if Model is None:
+        Model = _model_cache[key] = create_model(model_name, **fields)
+    return Model
 
 
 def _plugin_check_limit(plugin_spec: Dict[str, Any], key: str, char_limit: int):
@@ -177,80 +269,113 @@ def _plugin_check_limit(plugin_spec: Dict[str, Any], key: str, char_limit: int):
         f"Key \"{key}\" in plugin spec is too long. Expected: <={char_limit}, found: {len(plugin_spec[key])}."
 
 
-def _generate_description(func: Callable) -> str:
-    def _get_langchain_description(func_str: str) -> str:
-        global _func_description_chain
-        if _func_description_chain is not None:
-            return _func_description_chain.run(func_str=func_str)
+@functools.lru_cache(maxsize=1)
+def _get_description_chain():
+    """ Builds the description chain on first use. lru_cache keeps the one instance for the whole process """
+    try:
+        from langchain.llms import OpenAI
+        from langchain.prompts import PromptTemplate
+        from langchain.chains import LLMChain
+    except ImportError:
+        raise ImportError("Please install dependencies with `pip install 'autoplugin[gen]` to generate function descriptions. Otherwise, set `generate_description=False` when registering your function.")
+    llm = OpenAI(**_DESCRIPTION_LLM_KWARGS)
+    # prompt = PromptTemplate(
+    #     input_variables=["func_str"],
+    #     template="""
+    #         Come up with a concise description for this function for the OpenAPI spec that would serve as a useful description for a ChatGPT plugin to know when to call it.
+    #         It should be at most one or two sentences, and must be less than 50 words.
+    #         Function:
+    #         ```python
+    #         {func_str}
+    #         ```
+    #         Description:
+    #         """
+    # )
+    prompt = PromptTemplate(input_variables=["func_str"], template=_DESCRIPTION_PROMPT_TEMPLATE)
+    return LLMChain(llm=llm, prompt=prompt)
+
+
+def _generate_descriptions(funcs: List[Callable]) -> List[str]:
+    descriptions = []
+    missing = {}  # index in descriptions -> (function source, cache path)
+    for func in funcs:
+        func_str = _func_source(func)
+        cache_path = _description_cache_path(func_str)
+        if os.path.exists(cache_path):
+            with open(cache_path, "r", encoding="utf-8") as f:
+                descriptions.append(f.read())
+        else:
+            missing[len(descriptions)] = (func_str, cache_path)
+            descriptions.append(None)
+    if not missing:
+        return descriptions
+
+    # apply() sends all prompts to the completions endpoint in one request
+    outputs = _get_description_chain().apply([{"func_str": func_str} for func_str, _ in missing.values()])
+    generated = [output["text"] for output in outputs]
+    for (i, (_, cache_path)), description in zip(missing.items(), generated):
+        descriptions[i] = description
         try:
-            from langchain.llms import OpenAI
-            from langchain.prompts import PromptTemplate
-            from langchain.chains import LLMChain
-        except ImportError:
-            raise ImportError("Please install dependencies with `pip install 'autoplugin[gen]` to generate function descriptions. Otherwise, set `generate_description=False` when registering your function.")
-        llm = OpenAI(temperature=0, max_tokens=100)
-        # prompt = PromptTemplate(
-        #     input_variables=["func_str"],
-        #     template="""
-        #         Come up with a concise description for this function for the OpenAPI spec that would serve as a useful description for a ChatGPT plugin to know when to call it.
-        #         It should be at most one or two sentences, and must be less than 50 words.
-        #         Function:
-        #         ```python
-        #         {func_str}
-        #         ```
-        #         Description:
-        #         """
-        # )
-        prompt = PromptTemplate(
-            input_variables=["func_str"],
-            template="""
-                Come up with a concise description for this function for the OpenAPI spec that would serve as a useful description for a ChatGPT plugin to know when to call it.
-                It should be at most one or two sentences, and must be less than 50 words.
-                Function:
-                ```python
-                async def add(a: int, b: int) -> int:
-                    return a + b
-                ```
-                Description:
-                Adds two numbers
-                Function:
-                ```python
-                async def hello(name: str) -> str:
-                    return "Hello, " + name + "!".
-                ```
-                Description:
-                Greets person with specified name.
-                Function:
-                ```python
-                async def pow(base: int, power: int = 2) -> int:
-                    return base ** pow
-                ```
-                Description:
-                Raises a number to a power.
-                Function:
-                ```python
-                {func_str}
-                ```
-                Description:
-                """
-        )
-        chain = LLMChain(llm=llm, prompt=prompt)
-        _func_description_chain = chain
-        return chain.run(func_str=func_str)
+            os.makedirs(dirname(cache_path), exist_ok=True)
+            # write then rename, so concurrent readers never see a partially written file
+            fd, tmp_path = tempfile.mkstemp(dir=dirname(cache_path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.write(description)
+                os.replace(tmp_path, cache_path)
+            except OSError:
+                os.remove(tmp_path)
+                raise
+        except OSError:  # e.g. read-only home directory. caching is best-effort
+            pass
+    return descriptions
+
 
+def _func_source(func: Callable) -> str:
+    """ Canonical source of `func` (comments and formatting stripped) for the LLM prompt and the description cache key """
+    if hasattr(ast, "unparse"):  # Python 3.9+
+        try:
+            node = _func_node(func)
+        except Exception:  # source missing or unparsable here, leave it to inspect.getsource
+            node = None
+        if node is not None:
+            return ast.unparse(node)
     try:
-        func_str = inspect.getsource(func)
+        return inspect.getsource(func)
     except (OSError, TypeError):
         signature = inspect.signature(func)
         params = []
         for param in signature.parameters.values():
-            if param.annotation == inspect.Parameter.empty:
+            if param.annotation is _EMPTY:
                 params.append(param.name)
             else:
                 params.append(f"{param.name}: {param.annotation.__name__}")
-        return_description = "" if signature.return_annotation == inspect.Signature.empty else f" -> {signature.return_annotation.__name__}"
+        return_description = "" if signature.return_annotation is _EMPTY else f" -> {signature.return_annotation.__name__}"
         signature_string = f"{func.__name__}({', '.join(params)}){return_description}"
         func_doc = f"\n\t{func.__doc__}" if func.__doc__ is not None else ""
-        func_str = f"{signature_string}{func_doc}"
-    description = _get_langchain_description(func_str)
-    return description
\ No newline at end of file
+        return f"{signature_string}{func_doc}"
+
+
+def _func_node(func: Callable) -> Optional[ast.AST]:
+    path = inspect.getsourcefile(func)
+    linecache.checkcache(path)  # pick up edits made since the file was last read
+    # linecache also covers sources that only exist in memory, e.g. IPython/Jupyter cells
+    module = _parse_source("".join(linecache.getlines(path, func.__globals__)), path)
+    first_line = func.__code__.co_firstlineno  # first decorator line for decorated functions
+    for node in ast.walk(module):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name == func.__name__ \
+                and min([node.lineno] + [decorator.lineno for decorator in node.decorator_list]) == first_line:
+            return node
+    return None
+
+
+@functools.lru_cache(maxsize=128)
+def _parse_source(source: str, path: str) -> ast.Module:
+    return ast.parse(source, filename=path)
+
+
+def _description_cache_path(func_str: str) -> str:
+    # the prompt and LLM settings shape the description too, so changing either invalidates old entries
+    key_source = "\0".join((func_str, _DESCRIPTION_PROMPT_TEMPLATE, repr(sorted(_DESCRIPTION_LLM_KWARGS.items()))))
+    key = hashlib.blake2b(key_source.encode(), digest_size=16).hexdigest()
+    return join(_description_cache_dir, f"{key}.txt")
\ No newline at end of file
@@ -1,9 +1,13 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from .responses import JSONResponse
 
 def get_app():
-    app = FastAPI()
+    app = FastAPI(default_response_class=JSONResponse)
 
+    # added before CORS so CORS is the outer middleware and answers preflight requests without reaching GZip
+    app.add_middleware(GZipMiddleware, minimum_size=500)  # small JSON bodies aren't worth compressing
     app.add_middleware(
         CORSMiddleware,
         allow_origins=["*"],  # You can specify a list of allowed origins, or use ["*"] to allow all origins.
@@ -0,0 +1,36 @@
+"""
+Copyright (c) 2023, Suvansh Sanjeev
+All rights reserved.
+
+This source code is licensed under the BSD-style license found in the
+LICENSE file in the root directory of this source tree.
+"""
+import argparse
+import importlib
+import os
+import sys
+from typing import List, Optional
+
+from .autoplugin import generate
+
+
+def main(argv: Optional[List[str]] = None):
+    """ `autoplugin-gen module:app` writes ai-plugin.json and openapi.yaml for the app, e.g. once at build time """
+    parser = argparse.ArgumentParser(prog="autoplugin-gen",
+                                     description="Generate the ChatGPT plugin files for an AutoPlugin app.")
+    parser.add_argument("app", help="the app to generate files for, as `module:variable` (variable defaults to `app`)")
+    parser.add_argument("--version", default="v1", help="version for both the plugin and OpenAPI specs")
+    parser.add_argument("--out-dir", default=".well-known", help="directory to save both files to")
+    parser.add_argument("--name", default="", help="used for both name_for_human and name_for_model")
+    parser.add_argument("--description", default="",
+                        help="used for both description_for_human and description_for_model")
+    args = parser.parse_args(argv)
+
+    module_name, _, app_var = args.app.partition(":")
+    sys.path.insert(0, os.getcwd())  # resolve the module like `python -m` or `uvicorn` would
+    app = getattr(importlib.import_module(module_name), app_var or "app")
+    generate(app, version=args.version, out_dir=args.out_dir, name=args.name, description=args.description)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+"""
+Copyright (c) 2023, Suvansh Sanjeev
+All rights reserved.
+
+This source code is licensed under the BSD-style license found in the
+LICENSE file in the root directory of this source tree.
+"""
+import json
+from typing import Any
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import ORJSONResponse
+
+
+def dumps(content: Any) -> bytes:
+    """ Serializes with orjson, using FastAPI's jsonable_encoder for anything orjson doesn't support natively
+    (e.g. Decimal, set, pydantic models) """
+    try:
+        return orjson.dumps(content, default=jsonable_encoder, option=orjson.OPT_NON_STR_KEYS)
+    except TypeError:  # e.g. ints beyond 64 bits, which orjson rejects without consulting `default`
+        return json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False,
+                          separators=(",", ":")).encode("utf-8")
+
+
+class JSONResponse(ORJSONResponse):
+    """ ORJSONResponse that accepts every value FastAPI's default JSONResponse does """
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
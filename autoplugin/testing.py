@@ -4,6 +4,7 @@ import time
 import threading
 import uvicorn
 import requests
+import httpx
 from os.path import basename
 
 
@@ -31,6 +32,11 @@ def print_response(response):
     print(resp)
     return resp
 
+def asgi_client(app, base_url="http://testserver"):
+    """ Client that sends requests straight to the app in-process, without a server thread or sockets.
+    Use as `async with asgi_client(app) as client: response = await client.post("/hello", json={...})` """
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url=base_url)
+
 def testing_server(host="127.0.0.1", port=8000, app_file="example.py", app_var="app"):
     app_base = basename(app_file).split(".")[0]
     config = uvicorn.Config(f"{app_base}:{app_var}", host=host, port=port, log_level="info")
@@ -1,7 +1,7 @@
+import asyncio
 from autoplugin import register, generate, launch, get_app
 
-from autoplugin.testing import testing_server
-from os.path import join
+from autoplugin.testing import asgi_client
 
 
 app = get_app()
@@ -18,23 +18,20 @@ async def add(a: int, b: int) -> int:
 
 
 def test_api():
-    import requests
+    asyncio.run(_test_api())
 
-    host = "127.0.0.1"
-    port = 8000
-    server, base_url = testing_server(host=host, port=port, app_file=__file__, app_var="app")
 
-    with server.run_in_thread():
-        # Server is started. Do your tests here.
-        response = requests.post(join(base_url, "hello"), json={"name": "John Doe", "age": 31})
+async def _test_api():
+    async with asgi_client(app) as client:
+        # Requests go straight to the app, no server needed.
+        response = await client.post("/hello", json={"name": "John Doe", "age": 31})
         assert response.json() == {"result": "Hello, John Doe! Age 31."}
 
-        response = requests.get(join(base_url, "hello"), params={"name": "Jane Smith"})
+        response = await client.get("/hello", params={"name": "Jane Smith"})
         assert response.json() == {"result": "Hello, Jane Smith! Age 5."}
 
-        response = requests.get(join(base_url, "add"), params={"a": 6, "b": 8})
+        response = await client.get("/add", params={"a": 6, "b": 8})
         assert response.json() == {"result": 14}
-        # Server will be stopped.
 
 
 if __name__ == "__main__":
@@ -9,10 +9,16 @@ setup(
         "pydantic",
         "uvicorn",
         "requests",
+        "httpx",
         "PyYAML",
+        "orjson",
     ],
     extras_require={
         "gen": ["langchain"],
+        "fast": ["uvloop; sys_platform != 'win32' and platform_python_implementation == 'CPython'", "httptools"],
+    },
+    entry_points={
+        "console_scripts": ["autoplugin-gen=autoplugin.cli:main"],
     },
     author="Suvansh Sanjeev",
     author_email="suvansh@brilliantly.ai",